@@ -0,0 +1,423 @@
+#!/usr/bin/python
+
+#Benchmark for the generic XML parser
+
+#Generates a file of synthetic records from a configuration file, runs it through the parser and reports the throughput.
+#The time is split between reading the XML (iterparse), mapping records into tables and writing the statements.
+#Results are saved as JSON, and can be compared against the results of an earlier version.
+
+import lxml.etree as etree
+import os
+import sys
+import datetime
+import json
+import multiprocessing
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from optparse import OptionParser
+from xml.sax.saxutils import escape, quoteattr
+
+import generic_parser
+
+#the metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = [
+	("records_per_second", True),
+	("mb_per_second", True),
+	("peak_rss_mb", False),
+	("iterparse_seconds", False),
+	("mapping_seconds", False),
+	("emit_seconds", False),
+	("seconds", False),
+]
+
+def main():
+	usage = "usage: %prog [options]"
+	parser = OptionParser(usage)
+	parser.add_option("-c", "--config", dest="config_file", help="configuration file")
+	#-c REQUIRED, the records are generated from the tags, attributes and tables of the configuration file
+	parser.add_option("-p", "--parent", dest="parent", help="Name of the parent tag (tag containing the group of records")
+	parser.add_option("-r", "--record", dest="record", help="Name of the tag that defines a single record")
+	parser.add_option("-i", "--identifier", dest="identifier", help="Name of the tag whose value contains the unique identifier for the record")
+	parser.add_option("-n", "--namespace", dest="namespace", help="Namespace of the XML file")
+	#-p, -r, -i and -n are the same as for generic_parser.py
+	parser.add_option("-t", "--template", dest="template_file", help="template file, defaults to just $data")
+	parser.add_option("-m", "--database_mode", dest="database_mode", help="MySQL, Postgres, MSSQL, postgres-copy or mysql-loaddata, defaults to Postgres")
+	parser.add_option("-s", "--single_trans", dest="single_trans", help="If true, one transaction per file")
+	parser.add_option("-a", "--rows_per_insert", dest="rows_per_insert", help="Combine up to this many rows into one INSERT statement, defaults to 1")
+	parser.add_option("-x", "--compress", dest="compress", help="Compress the output with gzip, bz2 or zstd")
+	parser.add_option("--prune", dest="prune", help="If true, cut the subtrees the configuration file does not map before they are parsed")
+	#-t, -m, -s, -a, -x and --prune are passed on to the parser as they are for generic_parser.py
+	parser.add_option("-f", "--file", dest="filename", help="benchmark an existing XML file instead of generating one")
+	parser.add_option("-g", "--generate", dest="generate", help="only generate the synthetic records into this file, then stop")
+	parser.add_option("-z", "--size", dest="size", help="megabytes of synthetic records to generate, defaults to 10")
+	parser.add_option("-N", "--records", dest="records", help="number of synthetic records to generate, in place of --size")
+	parser.add_option("-F", "--fanout", dest="fanout", help="how many times each tag with a table repeats in a record, defaults to 3")
+	parser.add_option("-D", "--depth", dest="depth", help="how deep below the record tag to generate, defaults to the depth of the configuration file. Also the depth of the unmapped subtrees")
+	parser.add_option("-U", "--unmapped", dest="unmapped", help="number of subtrees the configuration file does not map to add to each record, defaults to 0")
+	parser.add_option("-S", "--seed", dest="seed", help="seed for the random values, defaults to 1")
+	#the same seed, size and shape always generate the same file
+	parser.add_option("-R", "--repeat", dest="repeat", help="number of times to run the parser, the fastest run is reported, defaults to 3")
+	parser.add_option("-w", "--work_dir", dest="work_dir", help="directory for the generated file and the parser output, which are kept. By default a temporary directory is used and removed")
+	parser.add_option("-o", "--output", dest="output", help="file to save the JSON results in")
+	parser.add_option("-C", "--compare", dest="compare", help="JSON results of an earlier run to compare against")
+	(options, args) = parser.parse_args()
+
+	if options.config_file is None or options.record is None or options.identifier is None:
+		print("ERROR: -c, -r and -i are required")
+		return 1
+
+	namespace = options.namespace or ''
+	root = etree.parse(open(options.config_file)).getroot()
+	plan = generic_parser.CompileConfig(root, "", namespace)
+	del root
+	if options.parent is not None:
+		rec_node = plan.Find(options.parent.split("/") + [options.record])
+	else:
+		rec_node = plan.Find([options.record])
+	if rec_node is None or rec_node.table is None:
+		print("ERROR: No table defined for the record tag %s in the configuration file" % (options.record))
+		return 1
+
+	shape = {
+		"fanout": int(options.fanout or 3),
+		"depth": int(options.depth) if options.depth is not None else None,
+		"unmapped": int(options.unmapped or 0),
+		"seed": int(options.seed or 1),
+	}
+	if options.records is not None:
+		shape["records"] = int(options.records)
+		shape["size"] = None
+	else:
+		shape["records"] = None
+		shape["size"] = float(options.size or 10)
+
+	if options.generate is not None:
+		records = GenerateFile(options.generate, rec_node, options.parent, options.identifier, namespace, shape)
+		print("Generated %d records, %d bytes in %s" % (records, os.path.getsize(options.generate), options.generate))
+		return 0
+
+	if options.work_dir is not None:
+		work_dir = options.work_dir
+		if not os.path.isdir(work_dir):
+			os.makedirs(work_dir)
+	else:
+		work_dir = tempfile.mkdtemp(prefix="generic-parser-benchmark-")
+
+	try:
+		if options.filename is not None:
+			filename = options.filename
+			shape = None
+		else:
+			filename = os.path.join(work_dir, "benchmark.xml")
+			print("Generating synthetic records into %s" % (filename))
+			GenerateFile(filename, rec_node, options.parent, options.identifier, namespace, shape)
+
+		settings = BuildSettings(options, rec_node, namespace)
+		outputtarget = os.path.join(work_dir, "benchmark-queries.txt")
+		if settings.compress is not None:
+			outputtarget = outputtarget + generic_parser.COMPRESSION_EXTENSIONS[settings.compress]
+
+		runs = []
+		for repeat in range(int(options.repeat or 3)):
+			run = RunInProcess(filename, outputtarget, settings)
+			print("Run %d: %d records in %.3f seconds, %.1f records/sec, %.2f MB/sec, peak RSS %.1f MB" % (repeat + 1, run["records"], run["seconds"], run["records_per_second"], run["mb_per_second"], run["peak_rss_mb"]))
+			print("  iterparse %.3f s, mapping %.3f s, emit %.3f s" % (run["iterparse_seconds"], run["mapping_seconds"], run["emit_seconds"]))
+			runs.append(run)
+	finally:
+		if options.work_dir is None:
+			shutil.rmtree(work_dir)
+
+	best = min(runs, key=lambda run: run["seconds"])
+	results = {
+		"version": Version(),
+		"date": str(datetime.datetime.now()),
+		"python": sys.version.split()[0],
+		"lxml": ".".join([str(part) for part in etree.LXML_VERSION]),
+		"config": options.config_file,
+		"file": options.filename,
+		"shape": shape,
+		"settings": {
+			"database_mode": options.database_mode,
+			"single_trans": options.single_trans,
+			"rows_per_insert": settings.rows_per_insert,
+			"compress": settings.compress,
+			"template": options.template_file,
+		},
+		"runs": runs,
+		"best": best,
+	}
+
+	if options.output is not None:
+		outfile = open(options.output, "w")
+		json.dump(results, outfile, indent=2, sort_keys=True)
+		outfile.write("\n")
+		outfile.close()
+		print("Results saved to %s" % (options.output))
+
+	if options.compare is not None:
+		infile = open(options.compare)
+		earlier = json.load(infile)
+		infile.close()
+		PrintComparison(earlier, results)
+	return 0
+
+
+def BuildSettings(options, rec_node, namespace):
+	#Builds the ParseSettings for the run the way generic_parser.main does, for the options the benchmark passes on
+
+	database_mode = str(options.database_mode).lower()
+	if database_mode in ("mysql", "mysql-loaddata"):
+		db_mode = "mysql"
+		generic_parser.table_quote = "`"
+	elif database_mode == "mssql":
+		db_mode = "mssql"
+		generic_parser.table_quote = '"'
+	else:
+		db_mode = "postgres"
+		generic_parser.table_quote = '"'
+	generic_parser.sql_dialect = generic_parser.SqlDialect(db_mode)
+	if database_mode in ("postgres-copy", "mysql-loaddata"):
+		writer_class = generic_parser.CopyWriter
+	else:
+		writer_class = generic_parser.SqlWriter
+
+	if options.template_file is not None:
+		tfile = open(options.template_file)
+		template = generic_parser.CompiledTemplate(tfile.read())
+		tfile.close()
+	else:
+		template = generic_parser.CompiledTemplate("$data\n")
+
+	settings = generic_parser.ParseSettings(rec_node, template, namespace, options.parent, options.record, options.identifier, db_mode, options.single_trans or False, {}, writer_class)
+	if options.rows_per_insert is not None:
+		settings.rows_per_insert = int(options.rows_per_insert)
+	if options.compress is not None:
+		settings.compress = options.compress.lower()
+	settings.prune = str(options.prune).lower() == "true"
+	return settings
+
+
+def RunInProcess(filename, outputtarget, settings):
+	#Runs the parser in a fresh process, so each run's peak RSS is its own and not that of the runs or the generation before it
+	pool = multiprocessing.Pool(1, generic_parser.InitWorker, (settings,))
+	try:
+		run = pool.apply(RunWorker, (filename, outputtarget))
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+	return run
+
+def RunWorker(filename, outputtarget):
+	return TimeParse(filename, outputtarget, generic_parser.worker_settings)
+
+def TimeParse(filename, outputtarget, settings):
+	#Parses a file the way ParseFile and WriteRecords do, timing each step of each record
+	#iterparse is the time spent waiting for the next record element, mapping is ParseRecord, emit is the writer, including closing it
+
+	clock = time.time
+	file_number = generic_parser.GetFileNumber(filename, settings)
+	iterparse_seconds = 0.0
+	mapping_seconds = 0.0
+	emit_seconds = 0.0
+	records = 0
+	rows = 0
+
+	start = clock()
+	writer = settings.writer_class(outputtarget, settings, file_number)
+	if generic_parser.CompressionOf(filename) is None:
+		infile = None
+		elements = generic_parser.IterRecords(filename, settings)
+	else:
+		infile = generic_parser.OpenInput(filename)
+		elements = generic_parser.IterRecords(infile, settings)
+	emit_seconds = emit_seconds + clock() - start
+
+	before = clock()
+	for elem in elements:
+		mapped = clock()
+		iterparse_seconds = iterparse_seconds + mapped - before
+		id_value, rowList = generic_parser.ParseRecord(elem, settings, file_number)
+		written = clock()
+		mapping_seconds = mapping_seconds + written - mapped
+		writer.WriteRecord(id_value, rowList)
+		before = clock()
+		emit_seconds = emit_seconds + before - written
+		records = records + 1
+		rows = rows + len(rowList)
+	iterparse_seconds = iterparse_seconds + clock() - before
+
+	closed = clock()
+	writer.Close()
+	if infile is not None:
+		infile.close()
+	end = clock()
+	emit_seconds = emit_seconds + end - closed
+
+	seconds = end - start
+	megabytes = os.path.getsize(filename) / 1048576.0
+	return {
+		"records": records,
+		"rows": rows,
+		"input_mb": megabytes,
+		"output_mb": OutputSize(outputtarget) / 1048576.0,
+		"seconds": seconds,
+		"records_per_second": records / seconds if seconds else 0.0,
+		"mb_per_second": megabytes / seconds if seconds else 0.0,
+		"peak_rss_mb": generic_parser.PeakMemory(),
+		"iterparse_seconds": iterparse_seconds,
+		"mapping_seconds": mapping_seconds,
+		"emit_seconds": emit_seconds,
+	}
+
+def OutputSize(outputtarget):
+	#the size of everything the writer wrote, a bulk load writer writes a script and data files next to the target
+	directory = os.path.dirname(outputtarget) or "."
+	base = generic_parser.CopyBase(outputtarget)
+	total = 0
+	for name in os.listdir(directory):
+		path = os.path.join(directory, name)
+		if path == outputtarget or path.startswith(base + "-"):
+			total = total + os.path.getsize(path)
+	return total
+
+
+def GenerateFile(filename, rec_node, root_tag, id_tag, namespace, shape):
+	#Writes a file of synthetic records shaped like the configuration file, until it has shape["records"] records or shape["size"] megabytes
+	#Returns the number of records written
+
+	rng = random.Random(shape["seed"])
+	if root_tag is not None:
+		parents = root_tag.split("/")
+	else:
+		parents = []
+	id_path = id_tag.split("/")
+	if shape["size"] is not None:
+		limit_bytes = int(shape["size"] * 1048576)
+	else:
+		limit_bytes = None
+
+	output = open(filename, "w")
+	output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+	opening = "".join(["<%s>" % (tag) for tag in parents])
+	if namespace and parents:
+		#the namespace is given as {uri}, declare it as the default namespace on the outermost tag
+		opening = "<%s xmlns=%s>" % (parents[0], quoteattr(namespace.strip("{}"))) + "".join(["<%s>" % (tag) for tag in parents[1:]])
+	output.write(opening + "\n")
+
+	written = 0
+	records = 0
+	while True:
+		if shape["records"] is not None and records >= shape["records"]:
+			break
+		if limit_bytes is not None and written >= limit_bytes:
+			break
+		parts = []
+		GenerateElement(rec_node, parts, rng, shape, 0, [], id_path, records)
+		if not parents and namespace:
+			parts[0] = parts[0].replace("<%s" % (rec_node.tag), "<%s xmlns=%s" % (rec_node.tag, quoteattr(namespace.strip("{}"))), 1)
+		parts.append("\n")
+		text = "".join(parts)
+		output.write(text)
+		written = written + len(text)
+		records = records + 1
+		if not parents:
+			#a file without a parent tag holds a single record
+			break
+
+	output.write("".join(["</%s>" % (tag) for tag in reversed(parents)]) + "\n")
+	output.close()
+	return records
+
+def GenerateElement(mapnode, parts, rng, shape, depth, path, id_path, record):
+	#Appends the text of one element for a MapNode, with its mapped attributes, value and children, to parts
+
+	attributes = []
+	for attribName, mapping in sorted(mapnode.attribs.items()):
+		#leave out some of the attributes with a default, so the defaults are used
+		if mapping in [default[:2] for name, default in mapnode.defaults] and rng.random() < 0.2:
+			continue
+		attributes.append(" %s=%s" % (attribName, quoteattr(SyntheticValue(mapping[-1], rng))))
+	parts.append("<%s%s>" % (mapnode.tag, "".join(attributes)))
+
+	if path == id_path:
+		parts.append("GEN:%012d" % (record))
+	elif mapnode.value is not None:
+		parts.append(escape(SyntheticValue(mapnode.value[-1], rng)))
+
+	if shape["depth"] is None or depth < shape["depth"]:
+		for tag, child_node in sorted(mapnode.children.items()):
+			if "}" in tag:
+				#the same MapNode is also keyed by the namespaced tag
+				continue
+			if child_node.table is not None and child_node.table != mapnode.table:
+				repeats = shape["fanout"]
+			else:
+				repeats = 1
+			for repeat in range(repeats):
+				GenerateElement(child_node, parts, rng, shape, depth + 1, path + [tag], id_path, record)
+		if depth == 0:
+			for subtree in range(shape["unmapped"]):
+				GenerateUnmapped(parts, rng, shape["depth"] or 3)
+	parts.append("</%s>" % (mapnode.tag))
+
+def GenerateUnmapped(parts, rng, depth):
+	#Appends a subtree of tags that are not in the configuration file, which the parser has to read past
+	parts.append("<unmapped_%d level=\"%d\">" % (depth, depth))
+	if depth > 1:
+		GenerateUnmapped(parts, rng, depth - 1)
+	else:
+		parts.append(escape(SyntheticValue("unmapped", rng)))
+	parts.append("</unmapped_%d>" % (depth))
+
+def SyntheticValue(column, rng):
+	#A value for a column, of varying length, sometimes with a quote or a backslash that has to be escaped
+	words = [column] + [str(rng.randint(0, 99999)) for i in range(rng.randint(0, 6))]
+	roll = rng.random()
+	if roll < 0.05:
+		words.append("O'Brien")
+	elif roll < 0.07:
+		words.append("back\\slash")
+	return " ".join(words)
+
+
+def Version():
+	#the version of the parser being benchmarked, from git if it is available
+	directory = os.path.dirname(os.path.abspath(generic_parser.__file__))
+	try:
+		process = subprocess.Popen(["git", "describe", "--always", "--dirty"], cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		version = process.communicate()[0].strip()
+		if process.returncode == 0 and version:
+			return version
+	except OSError:
+		pass
+	return "unknown"
+
+def PrintComparison(earlier, results):
+	#Prints the best run of an earlier set of results next to the best run of these, with the change for each metric
+	print("Compared to %s (%s):" % (earlier.get("version"), earlier.get("date")))
+	if earlier.get("shape") != results["shape"] or earlier.get("file") != results["file"] or earlier["best"].get("records") != results["best"]["records"]:
+		print("WARNING: the earlier results are for different records, the numbers may not be comparable")
+	for metric, higher_is_better in COMPARED_METRICS:
+		before = earlier["best"].get(metric)
+		after = results["best"].get(metric)
+		if before is None or after is None:
+			continue
+		if before:
+			change = (after - before) * 100.0 / before
+		else:
+			change = 0.0
+		if (change > 0) == higher_is_better or change == 0:
+			verdict = ""
+		else:
+			verdict = " (worse)"
+		print("  %s: %.3f -> %.3f, %+.1f%%%s" % (metric, before, after, change, verdict))
+
+
+if __name__ == "__main__":
+	sys.exit(main())
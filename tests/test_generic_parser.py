@@ -0,0 +1,234 @@
+#Tests for generic_parser.py, run from the top of the project with
+#python -m unittest discover tests
+#Most tests run the parser as a script on a few records in a temporary directory, with the configuration and template of examples/simple
+
+import io
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+try:
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARSER = os.path.join(PROJECT, "generic_parser.py")
+EXAMPLE = os.path.join(PROJECT, "examples", "simple")
+
+sys.path.insert(0, PROJECT)
+import generic_parser
+
+def Person(id_text, name):
+	#a record of the simple example, without the identifier when id_text is None
+	if id_text is None:
+		return '<Person name="%s"><State>Ohio</State></Person>\n' % (name)
+	return '<Person name="%s"><Emp_Id>%s</Emp_Id><State>Ohio</State><Car color="Red">Ford</Car></Person>\n' % (name, id_text)
+
+class ParserTest(unittest.TestCase):
+	#Runs the parser on the People files written by Write, with the output in self.output
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.data = os.path.join(self.directory, "data")
+		self.output = os.path.join(self.directory, "output")
+		os.mkdir(self.data)
+		os.mkdir(self.output)
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	def Write(self, name, records):
+		outfile = open(os.path.join(self.data, name), "w")
+		outfile.write("<People>\n" + "".join(records) + "</People>\n")
+		outfile.close()
+	def Run(self, *args):
+		#Returns the exit status and the printed output of the parser
+		command = [sys.executable, PARSER, "-c", "config.xml", "-p", "People", "-r", "Person", "-i", "Emp_Id", "-t", "template.sql", "-d", self.data, "-o", self.output] + list(args)
+		process = subprocess.Popen(command, cwd=EXAMPLE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+		printed = process.communicate()[0]
+		return process.returncode, printed
+	def Read(self, name):
+		infile = open(os.path.join(self.output, name))
+		text = infile.read()
+		infile.close()
+		return text
+
+class DedupTest(ParserTest):
+
+	def testRecordWithoutIdentifier(self):
+		#a record without an identifier is not indexed, it is parsed and rejected
+		self.Write("d.xml", [Person("1", "Old"), Person(None, "Nobody"), Person("1", "New")])
+		status, printed = self.Run("--dedup", os.path.join(self.directory, "dedup.db"))
+		self.assertEqual(status, 0, printed)
+		self.assertIn("Older versions skipped: 1", printed)
+		queries = self.Read("d-queries.txt")
+		self.assertIn("'New'", queries)
+		self.assertNotIn("'Old'", queries)
+		self.assertIn('name="Nobody"', self.Read("d-rejects.xml"))
+
+class ChunkTest(ParserTest):
+
+	def testProcessingInstruction(self):
+		#a record or parent tag inside a processing instruction is not a record boundary
+		records = [Person(str(number), "P%d" % (number)) for number in range(20)]
+		records[5] = '<Person name="P5"><Emp_Id>5</Emp_Id><?note </Person><Person> </People>?><State>Ohio</State></Person>\n'
+		self.Write("c.xml", records)
+		status, printed = self.Run()
+		self.assertEqual(status, 0, printed)
+		serial = self.Read("c-queries.txt")
+		status, printed = self.Run("-w", "2", "-k", "0.0001")
+		self.assertEqual(status, 0, printed)
+		self.assertIn("20 records in", printed)
+		self.assertEqual(self.Read("c-queries.txt"), serial)
+
+class DatabaseTest(ParserTest):
+
+	def setUp(self):
+		ParserTest.setUp(self)
+		self.database = os.path.join(self.directory, "load.db")
+		connection = sqlite3.connect(self.database)
+		connection.execute("CREATE TABLE employee_list (id, file_number, name, type, state, color)")
+		connection.execute("CREATE TABLE emp_cars (id, car_ctr, color, car)")
+		connection.commit()
+		connection.close()
+		self.Write("b.xml", [Person(str(number), "P%d" % (number)) for number in range(20)])
+	def testChunksReportedTogether(self):
+		#the chunks of a file are loaded by the workers, and reported in one line for the file
+		status, printed = self.Run("-b", "sqlite:///" + self.database, "-w", "2", "-k", "0.0001")
+		self.assertEqual(status, 0, printed)
+		self.assertEqual([line.split(" rows")[0] for line in printed.splitlines() if line.startswith("Database:")], ["Database: 40"])
+	def testSingleTransactionChunks(self):
+		status, printed = self.Run("-b", "sqlite:///" + self.database, "-s", "true", "-w", "2", "-k", "0.0001")
+		self.assertEqual(status, 1, printed)
+		self.assertIn("can't be a single transaction", printed)
+
+@unittest.skipIf(pyarrow is None, "needs pyarrow")
+class ParquetTest(ParserTest):
+
+	def testWithoutFileNumbers(self):
+		#without -l the file number is -1, a number, in a string column
+		self.Write("p.xml", [Person("1", "Joe"), Person("2", "Amy")])
+		status, printed = self.Run("-m", "parquet")
+		self.assertEqual(status, 0, printed)
+		table = pyarrow.parquet.read_table(os.path.join(self.output, "p-employee_list.parquet")).to_pydict()
+		self.assertEqual(list(table["id"]), ["1", "2"])
+		self.assertEqual(list(table["file_number"]), ["-1", "-1"])
+
+class FileNumberTest(ParserTest):
+
+	def setUp(self):
+		ParserTest.setUp(self)
+		self.sheets = os.path.join(self.directory, "sheets")
+		os.mkdir(self.sheets)
+		self.sheet = os.path.join(self.sheets, "numbers.csv")
+		outfile = open(self.sheet, "w")
+		outfile.write("name,file_number\nf.xml,42\n")
+		outfile.close()
+		self.Write("f.xml", [Person("1", "Joe")])
+	def testWithoutCache(self):
+		#the sheet is only read, nothing is written next to it
+		status, printed = self.Run("-l", self.sheet)
+		self.assertEqual(status, 0, printed)
+		self.assertIn("'42'", self.Read("f-queries.txt"))
+		self.assertEqual(os.listdir(self.sheets), ["numbers.csv"])
+	def testCacheIndex(self):
+		cache = os.path.join(self.directory, "cache")
+		for run in range(2):
+			status, printed = self.Run("-l", self.sheet, "--cache", cache)
+			self.assertEqual(status, 0, printed)
+			self.assertIn("'42'", self.Read("f-queries.txt"))
+		self.assertEqual(len([name for name in os.listdir(cache) if name.endswith(".idx")]), 1)
+		self.assertEqual(os.listdir(self.sheets), ["numbers.csv"])
+	def testCacheNotWritable(self):
+		#a cache directory that can't be made falls back to reading the sheet
+		cache = os.path.join(self.sheet, "cache")
+		status, printed = self.Run("-l", self.sheet, "--cache", cache)
+		self.assertEqual(status, 0, printed)
+		self.assertIn("can't be written", printed)
+		self.assertIn("'42'", self.Read("f-queries.txt"))
+	@unittest.skipUnless(os.path.isdir("/proc/self/fd"), "needs /proc/self/fd")
+	def testOutOfDateIndex(self):
+		#the out of date index is closed before it is rebuilt
+		cache = os.path.join(self.directory, "cache")
+		os.mkdir(cache)
+		table = generic_parser.FileNumberTable(self.sheet, cache)
+		outfile = open(table.index, "w")
+		outfile.write("#0 0\n")
+		outfile.close()
+		opened = []
+		build = table.Build
+		def Build(header):
+			for descriptor in os.listdir("/proc/self/fd"):
+				try:
+					opened.append(os.readlink(os.path.join("/proc/self/fd", descriptor)))
+				except OSError:
+					pass
+			return build(header)
+		table.Build = Build
+		self.assertEqual(table.get("f.xml"), "42")
+		table.data.close()
+		self.assertNotIn(table.index, opened)
+
+class PruneTest(unittest.TestCase):
+
+	def setUp(self):
+		plan = generic_parser.CompileConfig(generic_parser.etree.parse(os.path.join(EXAMPLE, "config.xml")).getroot(), "", "")
+		self.settings = generic_parser.ParseSettings(plan.Find(["People", "Person"]), None, "", "People", "Person", "Emp_Id", "postgres", False, {}, generic_parser.SqlWriter)
+	def Prune(self, text):
+		reader = generic_parser.PruningReader(io.BytesIO(text), self.settings)
+		pruned = []
+		while True:
+			block = reader.read(generic_parser.PRUNE_BLOCK)
+			if not block:
+				return "".join(pruned)
+			pruned.append(block)
+	def testSelfClosingChild(self):
+		#an empty child of the same name, with attributes, is not counted as open
+		padding = "<Toy>ball</Toy>" * 100
+		text = '<People><Person><Emp_Id>1</Emp_Id><Pet kind="dog"><Pet kind="pup" age="1/2"/>%s</Pet><State>Ohio</State></Person></People>' % (padding)
+		self.assertEqual(self.Prune(text), '<People><Person><Emp_Id>1</Emp_Id><Pet kind="dog"/><State>Ohio</State></Person></People>')
+
+class TableOrderTest(unittest.TestCase):
+
+	def testChildOfTwoParents(self):
+		#notes is a child of both the person and the car, so it comes after emp_cars though the person's Note is walked first
+		text = '<People><Person table="employee_list"><Emp_Id></Emp_Id><Note table="notes">notes:text</Note><Car table="emp_cars" ctr_id="emp_cars:car_ctr">emp_cars:car<Note table="notes">notes:text</Note></Car></Person></People>'
+		plan = generic_parser.CompileConfig(generic_parser.etree.fromstring(text), "", "")
+		settings = generic_parser.ParseSettings(plan.Find(["People", "Person"]), None, "", "People", "Person", "Emp_Id", "postgres", False, {}, generic_parser.SqlWriter)
+		self.assertEqual([table for table, columns in settings.table_columns], ["employee_list", "emp_cars", "notes"])
+		self.assertEqual(sorted(settings.table_order, key=settings.table_order.get), ["employee_list", "emp_cars", "notes"])
+
+class RejectsTest(ParserTest):
+
+	def setUp(self):
+		ParserTest.setUp(self)
+		self.Write("r.xml", [Person(str(number), "P%d" % (number)) for number in range(10)] + [Person(None, "Nobody")])
+	def testRejected(self):
+		status, printed = self.Run()
+		self.assertEqual(status, 0, printed)
+		self.assertIn("11 records in", printed)
+		self.assertIn("1 rejected", printed)
+		queries = self.Read("r-queries.txt")
+		self.assertIn("'P9'", queries)
+		self.assertNotIn("Nobody", queries)
+		rejects = self.Read("r-rejects.xml")
+		self.assertIn("<!-- rejected record 10: ValueError: The record has no identifier Emp_Id -->", rejects)
+		self.assertIn('name="Nobody"', rejects)
+	def testOverBudget(self):
+		#a file over the error budget fails the run, and is not marked done
+		manifest = os.path.join(self.directory, "manifest.json")
+		status, printed = self.Run("--max_rejects", "0", "-y", manifest)
+		self.assertEqual(status, 1, printed)
+		self.assertIn("stopped after 11 records", printed)
+		self.assertNotIn('"done"', open(manifest).read())
+	def testOverBudgetChunks(self):
+		status, printed = self.Run("--max_rejects", "5%", "-w", "2", "-k", "0.0001")
+		self.assertEqual(status, 1, printed)
+		status, printed = self.Run("--max_rejects", "10%", "-w", "2", "-k", "0.0001")
+		self.assertEqual(status, 0, printed)
+
+if __name__ == "__main__":
+	unittest.main()